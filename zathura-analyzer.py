@@ -1,149 +1,242 @@
-import pandas as pd
 import re
 import argparse
+import os
 import sys
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import orjson
 import csv
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+# pandas, NumPy and matplotlib are imported inside the functions that use them,
+# so '--help' and a failed fetch do not pay for loading them.
 
 # --- Configuration ---
 API_URL = "http://localhost:5600"
-RAW_CSV_FILENAME = "zathura_activity_raw.csv" # Always the newest snapshot
-CLEANED_CSV_FILENAME = "zathura_activity_cleaned.csv" # Contains full activity OR delta activity
+RAW_CSV_FILENAME = "zathura_activity_raw.csv" # Newest snapshot; removed when stale and not rewritten (see --keep-raw)
+RAW_META_FILENAME = ".zathura_raw.meta" # Bucket 'last_updated' values the raw snapshot was built from
+CLEANED_FILENAME = "zathura_activity_cleaned.parquet" # Contains full activity OR delta activity
+CLEANED_META_FILENAME = ".zathura_cleaned.meta" # Bucket state of the cleaned file; only kept for full activity
+RAW_CSV_DTYPES = {'title': 'string', 'duration': 'float64'} # Only columns the cleaning steps read
+PAGE_PATTERN = re.compile(r'\[.*?(\d+)/(\d+).*?\]') # Current and total pages inside the title brackets
+
+# Shared session so all ActivityWatch requests reuse pooled connections
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
 
 # --- 1. Data Fetching (from zathura_csv.py) ---
 
+def _to_utc_array(timestamps):
+    """Parses ActivityWatch ISO timestamps into a naive UTC datetime64 array."""
+    import pandas as pd
+    return pd.to_datetime(timestamps, format='ISO8601', utc=True).to_numpy(dtype='datetime64[ns]')
+
+def _mark_not_afk(event_times, starts, ends):
+    """Flags the events that fall inside a non-AFK interval.
+
+    starts must be sorted and ends must hold the running max of the matching end times.
+    """
+    import numpy as np
+    i = np.searchsorted(starts, event_times, side='right') - 1
+    not_afk = i >= 0
+    not_afk[not_afk] = event_times[not_afk] <= ends[i[not_afk]]
+    return not_afk
+
 def get_events_from_bucket(bucket_id, limit=10000):
     """Fetches all events from a specified bucket."""
     url = f"{API_URL}/api/0/buckets/{bucket_id}/events"
     params = {"limit": limit}
     try:
-        response = requests.get(url, params=params)
+        response = SESSION.get(url, params=params)
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
+        return orjson.loads(response.content)
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         print(f"Error fetching events from bucket {bucket_id}: {e}")
         return None
 
-def fetch_and_save_raw_data():
-    """Fetches, processes, and exports Zathura activity to a raw CSV file."""
+def _output_is_current(output_file_name, meta_file_name, bucket_state):
+    """Returns True if output_file_name exists and its sidecar records exactly this bucket state."""
+    if None in bucket_state.values() or not os.path.exists(output_file_name):
+        return False
+    try:
+        with open(meta_file_name, encoding="utf-8") as meta_file:
+            return json.load(meta_file) == bucket_state
+    except (IOError, ValueError):
+        return False
+
+def _remove_files(*file_names):
+    """Deletes the given files, ignoring the ones that do not exist."""
+    for file_name in file_names:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+def _write_bucket_state(meta_file_name, bucket_state):
+    """Records the bucket state an output file was built from in its sidecar."""
+    with open(meta_file_name, "w", encoding="utf-8") as meta_file:
+        json.dump(bucket_state, meta_file)
+
+def fetch_and_save_raw_data(keep_raw=True):
+    """Fetches and processes Zathura activity, optionally exporting it to a raw CSV file.
+
+    Returns (success, raw_df, bucket_state). raw_df is None when the cached output
+    is still current: the raw CSV if keep_raw, otherwise the cleaned file.
+    """
     print("✨ Step 1: Fetching AFK and window events...")
     
     try:
-        buckets_response = requests.get(f"{API_URL}/api/0/buckets")
+        buckets_response = SESSION.get(f"{API_URL}/api/0/buckets")
         buckets_response.raise_for_status()
-        buckets = buckets_response.json()
-    except requests.exceptions.RequestException as e:
+        buckets = orjson.loads(buckets_response.content)
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
         print(f"Error fetching buckets: {e}")
-        return False
+        return False, None, None
 
     afk_bucket_id = next((b for b in buckets if b.startswith("aw-watcher-afk_")), None)
     window_bucket_id = next((b for b in buckets if b.startswith("aw-watcher-window_")), None)
 
     if not afk_bucket_id or not window_bucket_id:
         print("Could not find required buckets. Make sure ActivityWatch is running.")
-        return False
-
-    afk_events = get_events_from_bucket(afk_bucket_id)
-    window_events = get_events_from_bucket(window_bucket_id)
+        return False, None, None
+
+    bucket_state = {
+        bucket_id: buckets[bucket_id].get('last_updated')
+        for bucket_id in (afk_bucket_id, window_bucket_id)
+    }
+    raw_is_current = _output_is_current(RAW_CSV_FILENAME, RAW_META_FILENAME, bucket_state)
+    if not keep_raw and not raw_is_current:
+        # The raw CSV will not be rewritten, so never leave an outdated one behind
+        _remove_files(RAW_CSV_FILENAME, RAW_META_FILENAME)
+
+    # Skip the event download entirely if neither bucket changed since the output this run needs
+    if keep_raw:
+        output_is_current, output_file_name = raw_is_current, RAW_CSV_FILENAME
+    else:
+        output_is_current = _output_is_current(CLEANED_FILENAME, CLEANED_META_FILENAME, bucket_state)
+        output_file_name = CLEANED_FILENAME
+    if output_is_current:
+        print(f"   No new activity since the last fetch. Reusing {output_file_name}")
+        return True, None, bucket_state
+
+    # The two buckets are independent, so fetch them concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        afk_future = executor.submit(get_events_from_bucket, afk_bucket_id)
+        window_future = executor.submit(get_events_from_bucket, window_bucket_id)
+        afk_events, window_events = afk_future.result(), window_future.result()
 
     if not afk_events or not window_events:
         print("Failed to fetch events. Exiting.")
-        return False
+        return False, None, None
 
     print("   Processing events...")
+    import numpy as np
+    import pandas as pd
     
-    non_afk_intervals = []
-    for event in afk_events:
-        if event['data'].get('status') == 'not-afk':
-            start = datetime.fromisoformat(event['timestamp'].replace('Z', '+00:00'))
-            end = start + timedelta(seconds=event['duration'])
-            non_afk_intervals.append((start, end))
-
-    zathura_events = []
-    for event in window_events:
-        event_time = datetime.fromisoformat(event['timestamp'].replace('Z', '+00:00'))
-        if event['data'].get('app') == 'org.pwmt.zathura' and event['duration'] > 0:
-            is_afk = True
-            for start, end in non_afk_intervals:
-                if start <= event_time <= end:
-                    is_afk = False
-                    break
-            if not is_afk:
-                zathura_events.append(event)
-    
-    print(f"   Found {len(zathura_events)} Zathura events.")
-
-    grouped_activity = {}
-    for event in zathura_events:
-        title = event['data'].get('title')
-        if title:
-            if title not in grouped_activity:
-                grouped_activity[title] = {
-                    'duration': 0,
-                    'timestamp': event['timestamp']
-                }
-            grouped_activity[title]['duration'] += event['duration']
-    
-    data_list = []
-    for title, data in grouped_activity.items():
-        data_list.append({
-            'title': title,
-            'duration': data['duration'],
-            'timestamp': data['timestamp']
-        })
-
-    sorted_data = sorted(data_list, key=lambda x: x['duration'], reverse=True)
+    afk_df = pd.json_normalize(afk_events)
+    afk_df = afk_df[afk_df['data.status'] == 'not-afk']
+    starts = _to_utc_array(afk_df['timestamp'])
+    ends = starts + pd.to_timedelta(afk_df['duration'], unit='s').to_numpy()
+
+    # Sort intervals once so each event can bisect for its candidate interval.
+    # The running max of the end times keeps overlapping intervals correct.
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = np.maximum.accumulate(ends[order])
+
+    # Drop non-Zathura and zero-length events before any parsing; they are the vast majority
+    window_events = [
+        event for event in window_events
+        if event['data'].get('app') == 'org.pwmt.zathura' and event['duration'] > 0
+    ]
+    window_df = pd.DataFrame({
+        'title': [event['data'].get('title') for event in window_events],
+        'duration': [event['duration'] for event in window_events],
+        'timestamp': [event['timestamp'] for event in window_events],
+    })
+
+    not_afk = _mark_not_afk(_to_utc_array(window_df['timestamp']), starts, ends)
+    zathura_df = window_df[not_afk]
     
+    print(f"   Found {len(zathura_df)} Zathura events.")
+
+    zathura_df = zathura_df[zathura_df['title'].fillna('') != '']
+    raw_df = (
+        zathura_df
+        .groupby('title', as_index=False, sort=False)
+        .agg(duration=('duration', 'sum'), timestamp=('timestamp', 'first'))
+        .sort_values('duration', ascending=False, kind='stable')
+    )
+
+    if not keep_raw:
+        return True, raw_df, bucket_state
+
     try:
+        # Drop the old sidecar first so a failed write never looks like a valid cache
+        _remove_files(RAW_META_FILENAME)
+
         # Use csv.QUOTE_ALL for robust handling of titles with commas
-        with open(RAW_CSV_FILENAME, "w", newline="", encoding="utf-8") as csvfile:
-            fieldnames = ["title", "duration", "timestamp"]
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-            
-            writer.writeheader()
-            writer.writerows(sorted_data)
+        raw_df.to_csv(RAW_CSV_FILENAME, index=False, quoting=csv.QUOTE_ALL, encoding='utf-8')
+        _write_bucket_state(RAW_META_FILENAME, bucket_state)
         
         print(f"   Successfully saved raw Zathura activity snapshot to {RAW_CSV_FILENAME}")
-        return True
+        return True, raw_df, bucket_state
     except IOError as e:
         print(f"An error occurred while writing the raw CSV file: {e}")
-        return False
+        return False, None, None
 
 # --- Delta Calculation Helpers (Adapted from delta-calculator.py) ---
 
+def _parse_titles(titles):
+    """Splits window titles into (Book_Title, Current_Page, Total_Pages) in a single pass.
+
+    The book title is everything before the first '[' and the pages are searched
+    from that bracket onwards, so each title is scanned once by one regex.
+    """
+    import numpy as np
+    import pandas as pd
+    book_titles = []
+    pages = []
+    for title in titles.to_numpy():
+        if not isinstance(title, str):
+            book_titles.append(None)
+            pages.append((-1, -1))
+            continue
+        bracket = title.find('[')
+        if bracket < 0:
+            book_titles.append(title.strip())
+            pages.append((-1, -1))
+            continue
+        book_titles.append(title[:bracket].strip())
+        m = PAGE_PATTERN.search(title, bracket)
+        pages.append((int(m.group(1)), int(m.group(2))) if m else (-1, -1))
+
+    pages = np.array(pages, dtype=np.int64).reshape(-1, 2)
+    missing = pages[:, 0] < 0
+    return (
+        pd.array(book_titles, dtype='string'),
+        pd.arrays.IntegerArray(pages[:, 0], missing),
+        pd.arrays.IntegerArray(pages[:, 1], missing.copy()),
+    )
+
 def _clean_and_prepare_file(input_file_name, session_tag):
     """Loads, cleans, and standardizes one raw Zathura activity CSV, extracting total pages."""
-    try:
-        # Use csv.QUOTE_ALL for robust handling of titles with commas
-        df = pd.read_csv(input_file_name, encoding='utf-8', quoting=csv.QUOTE_ALL)
-    except FileNotFoundError:
+    if not os.path.exists(input_file_name):
         print(f"Error: Input file '{input_file_name}' not found. Cannot calculate delta.")
         sys.exit(1)
-    except Exception:
-        try:
-            df = pd.read_csv(input_file_name, encoding='iso-8859-1', quoting=csv.QUOTE_ALL)
-        except Exception as e:
-            print(f"Error loading file with available encodings: {e}")
-            sys.exit(1)
+    df = _load_raw_csv(input_file_name)
+    if df is None:
+        sys.exit(1)
 
     # Convert duration from seconds to minutes
     df['Duration_min'] = df['duration'] / 60
     
     # Extract Book Title, Current Page, AND Total Pages
-    page_data = df['title'].str.extract(r'\[.*?(\d+)/(\d+).*?\]')
-    df['Current_Page'] = pd.to_numeric(page_data[0], errors='coerce').astype('Int64')
-    df['Total_Pages'] = pd.to_numeric(page_data[1], errors='coerce').astype('Int64')
-
-    df['Book_Title'] = df['title'].str.replace(r'\s*\[.*', '', regex=True).str.strip()
+    book_titles, df['Current_Page'], df['Total_Pages'] = _parse_titles(df['title'])
+    df['Book_Title'] = book_titles
 
-    # Create a unique key for merging (Book + Page)
-    df['key'] = df['Book_Title'] + "-" + df['Current_Page'].astype(str)
-    
     # Keep only the necessary columns and rename duration to be session-specific
-    df_cleaned = df[['key', 'Book_Title', 'Current_Page', 'Total_Pages', 'Duration_min']].copy()
+    df_cleaned = df[['Book_Title', 'Current_Page', 'Total_Pages', 'Duration_min']].copy()
     df_cleaned.rename(columns={'Duration_min': f'Duration_min_{session_tag}'}, inplace=True)
     
     return df_cleaned
@@ -151,37 +244,34 @@ def _clean_and_prepare_file(input_file_name, session_tag):
 
 def calculate_delta_activity(file_start, file_end):
     """Calculates the delta activity between two raw Zathura snapshots and saves the result."""
+    import pandas as pd
     print(f"🔄 Step 2: Calculating delta activity between '{file_start}' (Initial) and '{file_end}' (Newest)...")
 
     # Load and Clean Both Files
     df_start = _clean_and_prepare_file(file_start, 'Start')
     df_end = _clean_and_prepare_file(file_end, 'End')
     
-    # Merge DataFrames
-    df_merged = pd.merge(
-        df_end[['key', 'Book_Title', 'Current_Page', 'Total_Pages', 'Duration_min_End']],
-        df_start[['key', 'Duration_min_Start']], 
-        on='key',
-        how='left' 
-    )
-    
-    # Fill NaN durations from the start file with 0 (pages read for the first time in this session)
-    df_merged['Duration_min_Start'] = df_merged['Duration_min_Start'].fillna(0)
+    # Look up each (Book + Page) pair's start duration; pages read for the first time in this session get 0
+    start_durations = df_start.groupby(
+        ['Book_Title', 'Current_Page'], dropna=False, sort=False
+    )['Duration_min_Start'].sum()
+    end_keys = pd.MultiIndex.from_frame(df_end[['Book_Title', 'Current_Page']])
+    df_end['Duration_min_Start'] = end_keys.map(start_durations).fillna(0).to_numpy()
     
     # Calculate Delta
-    df_merged['Duration_Delta_min'] = df_merged['Duration_min_End'] - df_merged['Duration_min_Start']
+    df_end['Duration_Delta_min'] = df_end['Duration_min_End'] - df_end['Duration_min_Start']
 
     # Final Filtering and Output Formatting
-    df_session_activity = df_merged[df_merged['Duration_Delta_min'] > 0].copy()
+    df_session_activity = df_end[df_end['Duration_Delta_min'] > 0].copy()
     
-    # Format the final DataFrame to match the 'zathura_activity_cleaned.csv' structure
+    # Format the final DataFrame to match the 'zathura_activity_cleaned.parquet' structure
     df_session_activity.rename(columns={'Duration_Delta_min': 'Duration_min'}, inplace=True)
     df_session_activity = df_session_activity[['Book_Title', 'Current_Page', 'Total_Pages', 'Duration_min']]
     df_session_activity['Duration_min'] = df_session_activity['Duration_min'].round(2)
     df_session_activity.sort_values(by=['Book_Title', 'Current_Page'], inplace=True)
     
     # Save the result to the standard cleaned file
-    df_session_activity.to_csv(CLEANED_CSV_FILENAME, index=False)
+    df_session_activity.to_parquet(CLEANED_FILENAME, index=False, compression='zstd')
     
     total_session_time = df_session_activity['Duration_min'].sum()
     print(f"   Delta calculation complete. Total Session Time: {total_session_time:.2f} minutes.")
@@ -190,38 +280,50 @@ def calculate_delta_activity(file_start, file_end):
 
 # --- 2. Data Cleaning (from zathura-data-cleaner.py) ---
 
-def clean_and_save_full_data(input_file_name, output_file_name):
-    """Cleans the raw CSV data (full activity) and saves the processed result."""
-    print(f"🛠️ Step 2: Cleaning full activity data from: {input_file_name}")
-
+def _load_raw_csv(input_file_name):
+    """Loads the columns needed for cleaning from a raw CSV, or returns None on failure."""
+    import pandas as pd
     try:
-        # Load the file with header and an encoding that supports Persian characters
-        df = pd.read_csv(input_file_name, encoding='utf-8')
+        # Load the file with header and an encoding that supports Persian characters;
+        # quoted titles (commas included) are handled by the pyarrow CSV reader
+        return pd.read_csv(input_file_name, usecols=list(RAW_CSV_DTYPES), dtype=RAW_CSV_DTYPES, encoding='utf-8', engine='pyarrow')
     except Exception:
         # Fallback encoding
         try:
-            df = pd.read_csv(input_file_name, encoding='iso-8859-1')
+            df = pd.read_csv(input_file_name, usecols=list(RAW_CSV_DTYPES), dtype=RAW_CSV_DTYPES, encoding='iso-8859-1', engine='pyarrow')
             print("   Warning: Used 'iso-8859-1' encoding for data loading.")
+            return df
         except Exception as e:
             print(f"Error loading file with available encodings: {e}")
+            return None
+
+def clean_and_save_full_data(raw_data, output_file_name):
+    """Cleans the raw data (full activity) and saves the processed result.
+
+    raw_data is either the in-memory raw DataFrame or the path of a raw CSV file.
+    """
+    import pandas as pd
+    if isinstance(raw_data, pd.DataFrame):
+        print("🛠️ Step 2: Cleaning full activity data from: in-memory snapshot")
+        df = raw_data[list(RAW_CSV_DTYPES)].copy()
+    else:
+        print(f"🛠️ Step 2: Cleaning full activity data from: {raw_data}")
+        df = _load_raw_csv(raw_data)
+        if df is None:
             return False
 
     # 1. Convert duration from seconds to minutes
     df['Duration_min'] = df['duration'] / 60
 
-    # 2. Page Numbers Extraction: capture the two numbers inside brackets
-    page_data = df['title'].str.extract(r'\[.*?(\d+)/(\d+).*?\]')
-    df['Current_Page'] = pd.to_numeric(page_data[0], errors='coerce').astype('Int64')
-    df['Total_Pages'] = pd.to_numeric(page_data[1], errors='coerce').astype('Int64')
-
-    # 3. Book Title Extraction: Remove the page part
-    df['Book_Title'] = df['title'].str.replace(r'\s*\[.*', '', regex=True).str.strip()
+    # 2-3. Page Numbers and Book Title Extraction: one pass over the titles
+    book_titles, df['Current_Page'], df['Total_Pages'] = _parse_titles(df['title'])
+    df['Book_Title'] = book_titles
 
     # 4. Drop original columns
-    df = df.drop(columns=['title', 'duration', 'timestamp'])
+    df = df.drop(columns=['title', 'duration'])
 
     # --- Saving ---
-    df.to_csv(output_file_name, index=False)
+    df.to_parquet(output_file_name, index=False, compression='zstd')
     print(f"   Successfully cleaned data ({len(df)} records) and saved to: {output_file_name}")
     return True
 
@@ -229,13 +331,17 @@ def clean_and_save_full_data(input_file_name, output_file_name):
 
 def analyze_and_plot(book_title_pattern, page_range):
     """Analyzes the cleaned data (full or delta) and generates a plot."""
+    import pandas as pd
+    import matplotlib
+    matplotlib.use('Agg') # Plots are only saved to files, so skip GUI backend probing
+    import matplotlib.pyplot as plt
     print("\n📊 Step 3: Starting data analysis and visualization...")
 
     # --- Data Loading ---
     try:
-        df = pd.read_csv(CLEANED_CSV_FILENAME)
+        df = pd.read_parquet(CLEANED_FILENAME)
     except FileNotFoundError:
-        print(f"Error: '{CLEANED_CSV_FILENAME}' not found. Ensure the cleaning step succeeded.")
+        print(f"Error: '{CLEANED_FILENAME}' not found. Ensure the cleaning step succeeded.")
         sys.exit(1)
 
     # --- Page Range Parsing ---
@@ -248,11 +354,15 @@ def analyze_and_plot(book_title_pattern, page_range):
         sys.exit(1)
 
     # --- Filtering (Regex Search Enabled) ---
-    matching_df = df[
-        df['Book_Title'].str.contains(book_title_pattern, case=False, na=False, regex=True)
-    ].copy()
-
-    unique_matches = matching_df['Book_Title'].unique()
+    # Match against the distinct titles only; the rows are then picked by equality
+    titles = df['Book_Title'].dropna().unique()
+    if re.escape(book_title_pattern) == book_title_pattern:
+        # Plain substring: skip the regex engine entirely
+        needle = book_title_pattern.lower()
+        unique_matches = [title for title in titles if needle in title.lower()]
+    else:
+        pattern = re.compile(book_title_pattern, re.IGNORECASE)
+        unique_matches = [title for title in titles if pattern.search(title)]
     
     if len(unique_matches) == 0:
         print(f"No book titles found matching the pattern: '{book_title_pattern}'.")
@@ -266,7 +376,7 @@ def analyze_and_plot(book_title_pattern, page_range):
         sys.exit(1)
 
     selected_title = unique_matches[0]
-    df_filtered = matching_df
+    df_filtered = df[df['Book_Title'] == selected_title]
     
     df_filtered = df_filtered[
         (df_filtered['Current_Page'] >= start_page) &
@@ -291,16 +401,16 @@ def analyze_and_plot(book_title_pattern, page_range):
     print("-" * 60)
     
     # --- Visualization (Bar Plot with Average Line) ---
-    plt.figure(figsize=(10, 6))
+    fig, ax = plt.subplots(figsize=(10, 6))
     
     df_plot = df_agg.sort_values(by='Current_Page')
 
     x_labels = df_plot['Current_Page'].astype(int).tolist()
     x_positions = range(len(x_labels))
 
-    plt.bar(x_positions, df_plot['Duration_min'], color='darkcyan', label='Duration per Page')
+    ax.bar(x_positions, df_plot['Duration_min'], color='darkcyan', label='Duration per Page')
 
-    plt.axhline(
+    ax.axhline(
         avg_duration,
         color='red',
         linestyle='--',
@@ -309,22 +419,23 @@ def analyze_and_plot(book_title_pattern, page_range):
     )
     
     # UPDATED TITLE: Now includes Total Time
-    plt.title(
+    ax.set_title(
         f"Reading Duration per Page: {selected_title}\n(Pages {start_page} to {end_page}) & Total Time: {total_duration:.2f} min", 
         fontsize=14
     )
-    plt.xlabel("Page Number", fontsize=12)
-    plt.ylabel("Duration (Minutes)", fontsize=12)
+    ax.set_xlabel("Page Number", fontsize=12)
+    ax.set_ylabel("Duration (Minutes)", fontsize=12)
     
-    plt.xticks(x_positions, x_labels, rotation=45, ha='right')
+    ax.set_xticks(x_positions, x_labels, rotation=45, ha='right')
     
-    plt.grid(axis='y', linestyle=':', alpha=0.5)
-    plt.legend()
-    plt.tight_layout()
+    ax.grid(axis='y', linestyle=':', alpha=0.5)
+    ax.legend()
+    fig.tight_layout()
     
     # Save the plot
     plot_filename = f"{selected_title.replace('.pdf', '')}_p{start_page}-{end_page}_analysis.png"
-    plt.savefig(plot_filename)
+    fig.savefig(plot_filename)
+    plt.close(fig)
     print(f"✅ Bar plot saved as: {plot_filename}")
 
 
@@ -351,24 +462,42 @@ def main():
         default=None,
         help="Optional path to a previous raw Zathura activity CSV (Snapshot 1) to calculate the reading delta. If provided, the output will be the activity since this snapshot."
     )
+    parser.add_argument(
+        '--keep-raw',
+        action='store_true',
+        help=f"Also write the newest raw snapshot to '{RAW_CSV_FILENAME}' in full activity mode (always written in delta mode), e.g. to use it later as --initial-file. Without it, an outdated raw snapshot is deleted."
+    )
     args = parser.parse_args()
 
-    # 1. Fetch the Newest Activity Snapshot
-    if not fetch_and_save_raw_data():
+    # 1. Fetch the Newest Activity Snapshot (the delta step reads it back from disk)
+    keep_raw = args.keep_raw or bool(args.initial_file)
+    success, raw_df, bucket_state = fetch_and_save_raw_data(keep_raw=keep_raw)
+    if not success:
         print("Pipeline aborted after data fetching failure.")
         sys.exit(1)
 
     # 2. Clean or Calculate Delta
     if args.initial_file:
         # Delta Mode: Calculate the difference between the initial file and the newest snapshot
+        # The cleaned file is about to hold delta activity, so it no longer matches its sidecar
+        _remove_files(CLEANED_META_FILENAME)
         if not calculate_delta_activity(args.initial_file, RAW_CSV_FILENAME):
             print("Pipeline aborted after delta calculation failure.")
             sys.exit(1)
+    elif raw_df is None and not keep_raw:
+        # Full Activity Mode, nothing changed: the cleaned file from the last run is still current
+        print(f"🛠️ Step 2: Skipped, {CLEANED_FILENAME} is up to date.")
     else:
-        # Full Activity Mode: Clean the newest snapshot directly
-        if not clean_and_save_full_data(RAW_CSV_FILENAME, CLEANED_CSV_FILENAME):
+        # Full Activity Mode: Clean the newest snapshot directly, in memory unless it was reused from disk
+        raw_data = raw_df if raw_df is not None else RAW_CSV_FILENAME
+        _remove_files(CLEANED_META_FILENAME)
+        if not clean_and_save_full_data(raw_data, CLEANED_FILENAME):
             print("Pipeline aborted after data cleaning failure.")
             sys.exit(1)
+        try:
+            _write_bucket_state(CLEANED_META_FILENAME, bucket_state)
+        except IOError as e:
+            print(f"   Warning: Could not record the cleaned data's bucket state: {e}")
 
     # 3. Analyze and Plot
     analyze_and_plot(args.book_title, args.page_range)